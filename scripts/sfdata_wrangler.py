@@ -24,6 +24,7 @@ __license__     = """
 
 import sys
 import datetime
+import pandas as pd
 
 sys.path.append('D:/WORKSPACE/sfdata_wrangler/sfdata_wrangler')
 
@@ -321,8 +322,10 @@ if __name__ == "__main__":
         startTime = datetime.datetime.now()  
         sfmuniHelper = SFMuniDataHelper()
         sfmuniHelper.readRouteEquiv(ROUTE_EQUIV) 
+        sfmuniStore = pd.HDFStore(CLEANED_OUTFILES_STEP1[0])
         for infile in RAW_STP_FILES: 
-            sfmuniHelper.processRawData(infile, CLEANED_OUTFILES_STEP1[0])
+            sfmuniHelper.processRawData(infile, sfmuniStore)
+        sfmuniStore.close()
         print ('Finished cleaning step 1 SFMuni data in ', (datetime.datetime.now() - startTime))
 
     # update RouteEquiv and write to separate files by year
@@ -338,13 +341,15 @@ if __name__ == "__main__":
     if 'gtfs' in STEPS_TO_RUN: 
         startTime = datetime.datetime.now()   
         gtfsHelper = GTFSHelper() 
-        gtfsHelper.processFiles(RAW_GTFS_FILES, GTFS_OUTFILE, 'sfmuni', use_shape_dist=False)        
-        gtfsHelper.createDailySystemTotals(RAW_GTFS_FILES, GTFS_OUTFILE, 'sfmuni', 'sfmuniDaily')
-        gtfsHelper.createMonthlySystemTotals(GTFS_OUTFILE,'sfmuniDaily','sfmuniMonthly')
+        gtfsStore = pd.HDFStore(GTFS_OUTFILE)
+        gtfsHelper.processFiles(RAW_GTFS_FILES, gtfsStore, 'sfmuni', use_shape_dist=False)        
+        gtfsHelper.createDailySystemTotals(RAW_GTFS_FILES, gtfsStore, 'sfmuni', 'sfmuniDaily')
+        gtfsHelper.createMonthlySystemTotals(gtfsStore,'sfmuniDaily','sfmuniMonthly')
         
-        gtfsHelper.processFiles(BART_GTFS_FILES, GTFS_OUTFILE, 'bart', use_shape_dist=True)
-        gtfsHelper.createDailySystemTotals(BART_GTFS_FILES, GTFS_OUTFILE, 'bart', 'bartDaily')
-        gtfsHelper.createMonthlySystemTotals(GTFS_OUTFILE,'bartDaily','bartMonthly')
+        gtfsHelper.processFiles(BART_GTFS_FILES, gtfsStore, 'bart', use_shape_dist=True)
+        gtfsHelper.createDailySystemTotals(BART_GTFS_FILES, gtfsStore, 'bart', 'bartDaily')
+        gtfsHelper.createMonthlySystemTotals(gtfsStore,'bartDaily','bartMonthly')
+        gtfsStore.close()
         
         print ('Finished processing GTFS data ', (datetime.datetime.now() - startTime) )
         
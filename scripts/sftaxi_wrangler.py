@@ -186,7 +186,7 @@ if __name__ == "__main__":
         startTime = datetime.datetime.now()   
         hwynet = HwyNetwork()
         hwynet.readDTANetwork(INPUT_DYNAMEQ_NET_DIR, INPUT_DYNAMEQ_NET_PREFIX, logging_dir=LOGGING_DIR) 
-        hwynet.initializeSpatialIndex()
+        hwynet.initializeLinkTree()
         hwynet.initializeShortestPathsBetweenLinks()
         print 'Finished preparing highway network in ', (datetime.datetime.now() - startTime)
         
@@ -23,9 +23,13 @@ __license__     = """
     along with sfdata_wrangler.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+import os
+import math
+import zipfile
 import pandas as pd
 import numpy as np
 import datetime
+from collections import OrderedDict
 
 import sys
 import transitfeed  
@@ -35,18 +39,12 @@ from shapely.geometry import Point, LineString
 from SFMuniDataAggregator import SFMuniDataAggregator
 
                                     
-def convertLongitudeLatitudeToXY(lon_lat):        
-    """
-    Converts longitude and latitude to an x,y coordinate pair in
-    NAD83 Datum (most of our GIS and CUBE files)
-    
-    Returns (x,y) in feet.
-    """
-    FEET_TO_METERS = 0.3048006096012192
-    
-    (longitude,latitude) = lon_lat
+FEET_TO_METERS = 0.3048006096012192
 
-    p = Proj(proj  = 'lcc',
+# NAD83 Datum, California State Plane Zone III (most of our GIS and CUBE files).
+# Set up once, because initializing the projection is much slower than 
+# converting a point.  
+SF_PROJ = Proj(proj  = 'lcc',
             datum = "NAD83",
             lon_0 = "-120.5",
             lat_1 = "38.43333333333",
@@ -56,34 +54,39 @@ def convertLongitudeLatitudeToXY(lon_lat):
             units = "m",
             x_0   = 2000000,
             y_0   = 500000) #use kwargs
-    x_meters,y_meters = p(longitude,latitude,inverse=False,errcheck=True)
+
+
+def convertLongitudeLatitudeToXY(lon_lat):        
+    """
+    Converts longitude and latitude to an x,y coordinate pair in
+    NAD83 Datum (most of our GIS and CUBE files)
+    
+    Returns (x,y) in feet.
+    """
+    
+    (longitude,latitude) = lon_lat
+
+    x_meters,y_meters = SF_PROJ(longitude,latitude,inverse=False,errcheck=True)
 
     return (x_meters/FEET_TO_METERS,y_meters/FEET_TO_METERS)
-        
+
+
+def convertLongitudeLatitudeToXYVec(longitude, latitude):        
+    """
+    Converts arrays of longitude and latitude to x,y coordinates in
+    NAD83 Datum (most of our GIS and CUBE files)
     
-                    
-def getWrapAroundTime(dateString, timeString):
+    Returns (x,y) arrays in feet.
     """
-    Converts a string in the format '%H:%M:%S' to a datetime object.
-    Accounts for the convention where service after midnight is counted
-    with the previous day, so input times can be >24 hours. 
-    """        
-    nextDay = False
-    hr, min, sec = timeString.split(':')
-    if int(hr)>= 24:
-        hr = str(int(hr) - 24)
-        timeString = hr + ':' + min + ':' + sec
-        nextDay = True
-        
-    datetimeString = dateString + ' ' + timeString    
-    time = pd.to_datetime(datetimeString, format='%Y-%m-%d %H:%M:%S')
-        
-    if nextDay: 
-       time = time + pd.DateOffset(days=1)
     
-    return time
-        
+    x_meters,y_meters = SF_PROJ(np.asarray(longitude, dtype=np.float64),
+                                np.asarray(latitude, dtype=np.float64),
+                                inverse=False,errcheck=True)
 
+    return (x_meters/FEET_TO_METERS,y_meters/FEET_TO_METERS)
+        
+    
+                    
 def calculateHeadways(df):
     """
     Calculates the headways for a group. Assumes data are grouped by: 
@@ -129,21 +132,29 @@ class GTFSHelper():
     
     """
 
+    # string lengths for the data columns, which are each stored separately
     STRING_LENGTHS = {
-        'AGENCY_ID'       : 10,  
-        'TOD'             : 10,    
-        'ROUTE_SHORT_NAME': 32,  
-        'ROUTE_LONG_NAME' : 40,  
-        'TRIP'            : 10,  
-        'DIR'             : 10,  
-        'TRIP_HEADSIGN'   : 64,  
-        'STOPNAME'        : 64,  
         'SCHED_DATES'     : 20, 
-        'ROUTE_ID'        : 10,  
-        'TRIP_ID'         : 12,  
-        'STOP_ID'         : 10,  
         'SERVICE_ID'      : 10,  
         }
+    
+    # all the other string fields are stored together in a single values 
+    # block with one width, so it must fit the longest of them (the trip
+    # headsign and stop name).  The padding in the shorter fields mostly
+    # compresses away.  
+    VALUES_LENGTH = 64
+    
+    # the schedule tables are mostly repeated strings, so compress them
+    COMPLIB   = 'blosc:zstd'
+    COMPLEVEL = 5
+    
+    # number of rows to write to the HDF table at a time
+    CHUNKSIZE = 100000
+    
+    # the fields we select on when reading the schedule back in.  Only these
+    # are written as data columns, and they get a table index, which is 
+    # built once after all the data are written
+    INDEX_COLUMNS = ['SCHED_DATES', 'SERVICE_ID', 'ROUTE_TYPE']
 
     def __init__(self):
         """
@@ -151,6 +162,14 @@ class GTFSHelper():
         """       
         self.schedule = None
         
+        # the GTFS file or directory the schedule was loaded from
+        self.gtfsFile = None
+        
+        # a dataframe with all the stop times in the feed, and a dictionary
+        # lookup between each trip ID and the positions of its stop times
+        self.stopTimes = None
+        self.stopTimeIndices = None
+        
     
     def establishTransitFeed(self, gtfs_file): 
         """
@@ -159,19 +178,92 @@ class GTFSHelper():
         tfl = transitfeed.Loader(feed_path=gtfs_file)
         self.schedule = tfl.Load()
         
+        self.gtfsFile = gtfs_file
+        self.stopTimes = None
+        self.stopTimeIndices = None
+    
+    
+    def readGTFSTable(self, table): 
+        """
+        Reads one table (e.g. 'stop_times') from the GTFS file or directory
+        directly into a dataframe, with all fields as strings. 
+        """
+        filename = table + '.txt'
+        
+        if os.path.isdir(self.gtfsFile): 
+            return pd.read_csv(os.path.join(self.gtfsFile, filename), dtype=str, 
+                               skipinitialspace=True, encoding='utf-8-sig')
         
-    def processFiles(self, infiles, outfile, outkey, use_shape_dist=False):
+        with zipfile.ZipFile(self.gtfsFile) as z: 
+            with z.open(filename) as f: 
+                return pd.read_csv(f, dtype=str, 
+                                   skipinitialspace=True, encoding='utf-8-sig')
+    
+    
+    def getStopTimesDataFrame(self): 
+        """
+        Returns a dataframe with one record for each stop time in the feed, 
+        joined to the stop attributes and sorted by trip and stop sequence.  
+        
+        This is much faster than getting the stop times for each trip 
+        from the schedule, so it is read once for each feed and kept.  
+        """
+        
+        if self.stopTimes is not None: 
+            return self.stopTimes
+        
+        # stop attributes, normalized and projected once for each stop
+        stops = self.readGTFSTable('stops')
+        stops = stops[['stop_id', 'stop_name', 'stop_lat', 'stop_lon']].copy()
+        stops['stop_id'] = stops['stop_id'].str.strip()
+        stops['stop_lat'] = stops['stop_lat'].astype(np.float64)
+        stops['stop_lon'] = stops['stop_lon'].astype(np.float64)
+        stops['STOPNAME'] = stops['stop_name'].astype(str).str.strip().str.upper()
+        stops['x'], stops['y'] = convertLongitudeLatitudeToXYVec(
+                                    stops['stop_lon'].values, stops['stop_lat'].values)
+        
+        # the stop times, joined to the stops
+        df = self.readGTFSTable('stop_times')
+        df['trip_id'] = df['trip_id'].str.strip()
+        df['stop_id'] = df['stop_id'].str.strip()
+        df['stop_sequence'] = df['stop_sequence'].astype(np.int64)
+        df['arrival_time'] = df['arrival_time'].str.strip()
+        df['departure_time'] = df['departure_time'].str.strip()
+        if 'shape_dist_traveled' in df: 
+            df['shape_dist_traveled'] = pd.to_numeric(df['shape_dist_traveled']).fillna(0)
+        else: 
+            df['shape_dist_traveled'] = 0.0
+        
+        df = pd.merge(df, stops, how='left', on='stop_id')
+        df['STOP_ID'] = df['stop_id'].astype(str).str.strip().str.upper()
+        
+        df.sort_values(['trip_id', 'stop_sequence'], inplace=True)
+        df.reset_index(drop=True, inplace=True)
+        
+        self.stopTimes = df
+        self.stopTimeIndices = df.groupby('trip_id', sort=False).indices
+        
+        return self.stopTimes
+        
+        
+    def processFiles(self, infiles, outstore, outkey, use_shape_dist=False):
         """
         Processes the list of GTFS files and stores
         them in an HDF format.   
+        
+        outstore - an open HDFStore, which the caller is responsible for closing
         """
         
-        outstore = pd.HDFStore(outfile) 
         if '/' + outkey in outstore.keys(): 
             outstore.remove(outkey)
            
         startIndex = 0
         
+        # string lengths can only be set for data columns, so the rest
+        # share a single width for the values block
+        minItemsize = dict(self.STRING_LENGTHS)
+        minItemsize['values'] = self.VALUES_LENGTH
+        
         for infile in infiles: 
             print ('\n\nReading ', infile)
             
@@ -181,22 +273,30 @@ class GTFSHelper():
                 
                 df = self.getGTFSDataFrame(period, startIndex, use_shape_dist=use_shape_dist)       
                 
-                outstore.append(outkey, df, data_columns=True, 
-                    min_itemsize=self.STRING_LENGTHS)
+                # the expected rows only matter when the table is created, 
+                # and are used to pick a sensible chunk shape
+                outstore.append(outkey, df, data_columns=self.INDEX_COLUMNS, 
+                    min_itemsize=minItemsize, 
+                    complib=self.COMPLIB, complevel=self.COMPLEVEL, 
+                    chunksize=self.CHUNKSIZE, 
+                    expectedrows=len(df) * len(servicePeriods) * len(infiles), 
+                    index=False)
         
                 startIndex += len(df)
         
-        outstore.close()
+        # build the index once, rather than updating it with every append
+        outstore.create_table_index(outkey, columns=self.INDEX_COLUMNS, 
+                                    optlevel=9, kind='full')
 
     
-    def createDailySystemTotals(self, infiles, outfile, inkey, outkey):
+    def createDailySystemTotals(self, infiles, outstore, inkey, outkey):
         """
         Converts from the detailed schedule information to the 
         daily system totals.
         
+        outstore - an open HDFStore, which the caller is responsible for closing
         """
         
-        outstore = pd.HDFStore(outfile) 
         if '/' + outkey in outstore.keys(): 
             outstore.remove(outkey)
 
@@ -255,8 +355,6 @@ class GTFSHelper():
             outstore.append(outkey, df, data_columns=True, 
                             min_itemsize=stringLengths)
 
-        outstore.close()
-
     def getAggDf(self, instore, inkey): 
     
         # determine the system totals, grouped by schedule dates
@@ -282,16 +380,16 @@ class GTFSHelper():
         return aggdf, stringLengths
         
         
-    def createMonthlySystemTotals(self,  outfile, inkey, outkey):
+    def createMonthlySystemTotals(self, outstore, inkey, outkey):
         """
         Converts from the detailed schedule information to the 
         daily system totals.
         
+        outstore - an open HDFStore, which the caller is responsible for closing
         """
         
         print ('Calculating monthly totals')
         
-        outstore = pd.HDFStore(outfile) 
         if '/' + outkey in outstore.keys(): 
             outstore.remove(outkey)
 
@@ -317,8 +415,6 @@ class GTFSHelper():
                         
         # write the data
         outstore.append(outkey, aggdf, data_columns=True, min_itemsize=stringLengths)
-
-        outstore.close()
     
     
     def getGTFSDataFrame(self, period, startIndex=0, route_types=range(0,100), use_shape_dist=False):
@@ -329,9 +425,6 @@ class GTFSHelper():
                          or to follow the shape distance.  For now, we use SL dist for MUNI because
                          some routes double back on themselves, and we can't handle that.  
         """
-                        
-        # create an empty list of dictionaries to store the data
-        data = []
         
         # determine the day-of-week as 1=weekday, 2=sat, 3=sun
         dow = getDayOfWeek(period.service_id)
@@ -340,195 +433,262 @@ class GTFSHelper():
         dateRange = self.schedule.GetDateRange()
         startDate = pd.to_datetime(dateRange[0], format='%Y%m%d')
         dateRangeString = str(dateRange[0]) + '-' + str(dateRange[1])
+        serviceIdString = str(period.service_id).strip().upper()
+        
+        # calculate fare--assume just based on route ID
+        routeFares = {}
+        fareAttributeList = self.schedule.GetFareAttributeList()
+        for fareAttribute in fareAttributeList:
+            fareRuleList = fareAttribute.GetFareRuleList()
+            for fareRule in fareRuleList:
+                routeFares[fareRule.route_id] = fareAttribute.price
+        
+        # route attributes are shared by many trips, so convert them once
+        # for each route, in the order they are stored below
+        routeAttributes = {}
+        
+        # all the stop times in the feed
+        stopTimes = self.getStopTimesDataFrame()
+        
+        # select the trips that run on this day, and only keep bus trips
+        # keep the positions of their stop times, so we know how many 
+        # records to allocate
+        selectedTrips = []
+        tripList = self.schedule.GetTripList()            
+        for trip in tripList:
+            if trip.service_id == period.service_id:          
+                if trip.route_id not in routeAttributes: 
+                    route = self.schedule.GetRoute(trip.route_id)
+                    routeAttributes[trip.route_id] = (
+                        str(route.agency_id).strip().upper(), 
+                        str(route.route_short_name).strip().upper(), 
+                        str(route.route_long_name).strip().upper(), 
+                        int(route.route_type), 
+                        str(trip.route_id).strip().upper(), 
+                        float(routeFares.get(trip.route_id, 0)))
+                if (routeAttributes[trip.route_id][3] in route_types):
+                    positions = self.stopTimeIndices.get(str(trip.trip_id).strip())
+                    if positions is not None and len(positions) > 0: 
+                        selectedTrips.append((trip, routeAttributes[trip.route_id], positions))
+        
+        # allocate one column for each field, with one record for each trip-stop
+        n = sum(len(positions) for (trip, routeAttribute, positions) in selectedTrips)
+        
+        # the stop attributes come straight from the stop times, in the 
+        # same order as the trips
+        if n > 0: 
+            allPositions = np.concatenate([positions for (trip, routeAttribute, positions) in selectedTrips])
+        else: 
+            allPositions = np.empty(0, dtype=np.int64)
+        selectedStopTimes = stopTimes.iloc[allPositions]
+        
+        seq              = selectedStopTimes['stop_sequence'].values
+        stopName         = selectedStopTimes['STOPNAME'].values
+        stopLat          = selectedStopTimes['stop_lat'].values
+        stopLon          = selectedStopTimes['stop_lon'].values
+        stopId           = selectedStopTimes['STOP_ID'].values
+        arrivalStrings   = selectedStopTimes['arrival_time'].values
+        departureStrings = selectedStopTimes['departure_time'].values
+        shapeDist        = selectedStopTimes['shape_dist_traveled'].values
+        stopX            = selectedStopTimes['x'].values
+        stopY            = selectedStopTimes['y'].values
+        
+        tod            = np.empty(n, dtype=object)
+        agencyId       = np.empty(n, dtype=object)
+        routeShortName = np.empty(n, dtype=object)
+        routeLongName  = np.empty(n, dtype=object)
+        direction      = np.empty(n, dtype=object)
+        tripName       = np.empty(n, dtype=object)
+        routeType      = np.empty(n, dtype=np.int64)
+        tripHeadsign   = np.empty(n, dtype=object)
+        fares          = np.empty(n, dtype=np.float64)
+        sol            = np.zeros(n, dtype=np.int64)
+        eol            = np.zeros(n, dtype=np.int64)
+        serviceMiles   = np.empty(n, dtype=np.float64)
+        routeId        = np.empty(n, dtype=object)
+        tripId         = np.empty(n, dtype=object)
         
         # create one record for each trip-stop, specific to the service
         # on this day
-        tripList = self.schedule.GetTripList()            
+        k = 0
+        for (trip, routeAttribute, positions) in selectedTrips:
             
-        for trip in tripList:
-            if trip.service_id == period.service_id:          
-                # determine route attributes, and only keep bus trips
-                route = self.schedule.GetRoute(trip.route_id)
-                if (int(route.route_type) in route_types):
-                                            
-                    # calculate fare--assume just based on route ID
-                    fare = 0
-                    fareAttributeList = self.schedule.GetFareAttributeList()
-                    for fareAttribute in fareAttributeList:
-                        fareRuleList = fareAttribute.GetFareRuleList()
-                        for fareRule in fareRuleList:
-                            if fareRule.route_id == trip.route_id: 
-                                fare = fareAttribute.price
-                        
-                    # one record for each stop time
-                    stopTimeList = trip.GetStopTimes()                            
-                        
-                    # get shape attributes, converted to a line
-                    # this is needed because they are sometimes out of order
-                    if (use_shape_dist): 
-                        shapeLine = self.getShapeLine(trip.shape_id, stopTimeList)
-                                                
-                    # initialize for looping
-                    i = 0        
-                    lastDepartureTime = startDate
+            (agencyIdString, routeShortNameString, routeLongNameString, 
+             routeTypeInt, routeIdString, fare) = routeAttribute
+            
+            m = len(positions)
                         
-                    for stopTime in stopTimeList:
-                        record = {}
-                            
-                        # first stop, last stop and trip based on order
-                        if i==0: 
-                            startOfLine = 1
-                            hr, min, sec = stopTime.departure_time.split(':')
-                            firstDeparture = int(hr + min)
-                            
-                            firstSeq = stopTime.stop_sequence
+            # get shape attributes, converted to a line
+            # this is needed because they are sometimes out of order
+            if (use_shape_dist): 
+                shapeLine = self.getShapeLine(trip.shape_id, 
+                                list(zip(stopX[k:k+m], stopY[k:k+m])))
+            
+            # first stop, last stop and trip based on order
+            hr, min, sec = departureStrings[k].split(':')
+            firstDeparture = int(hr + min)
+            firstSeq = seq[k]
                 
-                            # compute TEP time periods -- need to iterate
-                            if (firstDeparture >= 300  and firstDeparture < 600):  
-                                timeOfDay='0300-0559'
-                            elif (firstDeparture >= 600  and firstDeparture < 900):  
-                                timeOfDay='0600-0859'
-                            elif (firstDeparture >= 900  and firstDeparture < 1400): 
-                                timeOfDay='0900-1359'
-                            elif (firstDeparture >= 1400 and firstDeparture < 1600): 
-                                timeOfDay='1400-1559'
-                            elif (firstDeparture >= 1600 and firstDeparture < 1900): 
-                                timeOfDay='1600-1859'
-                            elif (firstDeparture >= 1900 and firstDeparture < 2200): 
-                                timeOfDay='1900-2159'
-                            elif (firstDeparture >= 2200 and firstDeparture < 9999): 
-                                timeOfDay='2200-0259'
-                            else:
-                                timeOfDay=''
-                                    
-                            # distance traveled along shape for previous stop
-                            lastDistanceTraveled = 0
-                            stopPoint = None
-                            lastStopPoint = None
-                        else:
-                            startOfLine = 0
-                            
-                        if i==(len(stopTimeList)-1):
-                            endOfLine = 1
-                        else: 
-                            endOfLine = 0
-                            
-                        # calendar attributes
-                        record['MONTH'] = startDate
-                        record['DATE'] = startDate
-                        record['DOW']  = dow
-                        record['TOD']  = timeOfDay
-                            
-                        # observations
-                        record['TRIP_STOPS'] = 1
-                        record['OBSERVED'] = 0
+            # compute TEP time periods -- need to iterate
+            if (firstDeparture >= 300  and firstDeparture < 600):  
+                timeOfDay='0300-0559'
+            elif (firstDeparture >= 600  and firstDeparture < 900):  
+                timeOfDay='0600-0859'
+            elif (firstDeparture >= 900  and firstDeparture < 1400): 
+                timeOfDay='0900-1359'
+            elif (firstDeparture >= 1400 and firstDeparture < 1600): 
+                timeOfDay='1400-1559'
+            elif (firstDeparture >= 1600 and firstDeparture < 1900): 
+                timeOfDay='1600-1859'
+            elif (firstDeparture >= 1900 and firstDeparture < 2200): 
+                timeOfDay='1900-2159'
+            elif (firstDeparture >= 2200 and firstDeparture < 9999): 
+                timeOfDay='2200-0259'
+            else:
+                timeOfDay=''
             
-                        # For matching to AVL data
-                        record['AGENCY_ID']        = str(route.agency_id).strip().upper()
-                        record['ROUTE_SHORT_NAME'] = str(route.route_short_name).strip().upper()
-                        record['ROUTE_LONG_NAME']  = str(route.route_long_name).strip().upper()
-                        record['DIR']              = str(trip.direction_id).strip().upper()
-                        record['TRIP']             = str(firstDeparture) + '_' + str(firstSeq)    # contains sequence and contains HHMM of departure from first stop
-                        record['SEQ']              = int(stopTime.stop_sequence)                            
-                            
-                        # route/trip attributes
-                        record['ROUTE_TYPE']       = int(route.route_type)
-                        record['TRIP_HEADSIGN']    = str(trip.trip_headsign).strip().upper()
-                        record['HEADWAY_S']        = np.NaN             # calculated below
-                        record['FARE']             = float(fare)  
-                        
-                        # stop attriutes
-                        record['STOPNAME']         = str(stopTime.stop.stop_name).strip().upper()
-                        record['STOP_LAT']         = float(stopTime.stop.stop_lat)
-                        record['STOP_LON']         = float(stopTime.stop.stop_lon)
-                        record['SOL']              = startOfLine
-                        record['EOL']              = endOfLine
-                            
-                        # stop times        
-                        # deal with wrap-around aspect of time (past midnight >2400)
-                        arrivalTime = getWrapAroundTime(str(startDate.date()), stopTime.arrival_time)
-                        departureTime = getWrapAroundTime(str(startDate.date()), stopTime.departure_time)
-                        if startOfLine or endOfLine: 
-                            dwellTime = 0.0
-                        else: 
-                            timeDiff = departureTime - arrivalTime
-                            dwellTime = round(timeDiff.seconds / 60.0, 2)
-    
-                        record['ARRIVAL_TIME_S']   = arrivalTime
-                        record['DEPARTURE_TIME_S'] = departureTime
-                        record['DWELL_S']          = dwellTime
-                            
-                        # runtimes
-                        if startOfLine: 
-                            runtime = 0
-                        else: 
-                            timeDiff = arrivalTime - lastDepartureTime
-                            runtime = max(0, round(timeDiff.total_seconds() / 60.0, 2))
-                        record['RUNTIME_S'] = runtime
-                        
-                        # total time is sum of runtime and dwell time
-                        tottime = runtime + dwellTime
-                        record['TOTTIME_S'] = tottime
-                            
-                        # location along shape object (SFMTA uses meters)
-                        if stopTime.shape_dist_traveled > 0: 
-                            distanceTraveled = stopTime.shape_dist_traveled * 3.2808399                            
-                        else: 
-                            x, y = convertLongitudeLatitudeToXY((stopTime.stop.stop_lon, stopTime.stop.stop_lat))
-                            stopPoint = Point(x, y)
-                            if (use_shape_dist): 
-                                projectedDist = shapeLine.project(stopPoint, normalized=True)
-                                distanceTraveled = shapeLine.length * projectedDist                        
-                            else: 
-                                if startOfLine == 1: 
-                                    distanceTraveled = 0
-                                else: 
-                                    distanceTraveled = lastDistanceTraveled + stopPoint.distance(lastStopPoint)
-
-                        # service miles
+            # trip attributes are the same for each stop, so fill them in as a block
+            tod[k:k+m]            = timeOfDay
+            
+            # For matching to AVL data
+            agencyId[k:k+m]       = agencyIdString
+            routeShortName[k:k+m] = routeShortNameString
+            routeLongName[k:k+m]  = routeLongNameString
+            direction[k:k+m]      = str(trip.direction_id).strip().upper()
+            tripName[k:k+m]       = str(firstDeparture) + '_' + str(firstSeq)    # contains sequence and contains HHMM of departure from first stop
+            
+            # route/trip attributes
+            routeType[k:k+m]      = routeTypeInt
+            tripHeadsign[k:k+m]   = str(trip.trip_headsign).strip().upper()
+            fares[k:k+m]          = fare
+            
+            # gtfs IDs
+            routeId[k:k+m]        = routeIdString
+            tripId[k:k+m]         = str(trip.trip_id).strip().upper()
+            
+            sol[k]                = 1
+            eol[k+m-1]            = 1
+            
+            # initialize for looping
+            lastDistanceTraveled = 0
+            stopPoint = None
+            lastStopPoint = None
+            
+            # the distances depend on the previous stop, so step through them
+            for i in range(k, k+m):
+                startOfLine = (sol[i]==1)
+                
+                # location along shape object (SFMTA uses meters)
+                if shapeDist[i] > 0: 
+                    distanceTraveled = shapeDist[i] * 3.2808399                            
+                else: 
+                    stopPoint = (stopX[i], stopY[i])
+                    if (use_shape_dist): 
+                        projectedDist = shapeLine.project(Point(stopPoint), normalized=True)
+                        distanceTraveled = shapeLine.length * projectedDist                        
+                    else: 
                         if startOfLine: 
-                            serviceMiles = 0
+                            distanceTraveled = 0
                         else: 
-                            serviceMiles = round((distanceTraveled - lastDistanceTraveled) / 5280.0, 3)
-                        
-                        record['SERVMILES_S'] = serviceMiles
-                                
-                        # speed (mph)
-                        if runtime > 0: 
-                            record['RUNSPEED_S'] = round(serviceMiles / (runtime / 60.0), 2)
-                        else:
-                            record['RUNSPEED_S'] = 0
-                            
-                        if tottime > 0: 
-                            record['TOTSPEED_S'] = round(serviceMiles / (tottime / 60.0), 2)
-                        else:
-                            record['TOTSPEED_S'] = 0
-                                                    
-                        # indicates range this schedule is in operation    
-                        record['SCHED_DATES'] = dateRangeString          # start and end date for this schedule
-                                                
-                        # gtfs IDs
-                        record['ROUTE_ID']  = str(trip.route_id).strip().upper()
-                        record['TRIP_ID']   = str(trip.trip_id).strip().upper()
-                        record['STOP_ID']   = str(stopTime.stop_id).strip().upper()
-                        record['SERVICE_ID']= str(trip.service_id).strip().upper()
-                        
-                        if serviceMiles < 0: 
-                            print('ERROR: Negative service miles')
-                            print(record)
-                            raise(ValueError)
-                                                
-                        # track from previous record
-                        lastDepartureTime = departureTime      
-                        lastDistanceTraveled = distanceTraveled     
-                        lastStopPoint = stopPoint
-                        
-                        data.append(record)                
-                        i += 1
+                            distanceTraveled = lastDistanceTraveled + math.hypot(
+                                stopPoint[0] - lastStopPoint[0], stopPoint[1] - lastStopPoint[1])
+
+                # service miles
+                if startOfLine: 
+                    miles = 0
+                else: 
+                    miles = round((distanceTraveled - lastDistanceTraveled) / 5280.0, 3)
+                
+                if miles < 0: 
+                    print('ERROR: Negative service miles')
+                    print('ROUTE_ID=%s TRIP_ID=%s STOP_ID=%s SEQ=%i' 
+                          % (routeId[i], tripId[i], stopId[i], seq[i]))
+                    raise(ValueError)
+                
+                serviceMiles[i] = miles
+                                                                
+                # track from previous record
+                lastDistanceTraveled = distanceTraveled     
+                lastStopPoint = stopPoint
+            
+            k += m
+        
+        # stop times, dealing with the wrap-around aspect of time (past 
+        # midnight >24:00:00), which is just an offset from the start date
+        arrivalOffsets   = pd.to_timedelta(arrivalStrings)
+        departureOffsets = pd.to_timedelta(departureStrings)
+        arrivalTimes     = startDate + arrivalOffsets
+        departureTimes   = startDate + departureOffsets
+        
+        arrivalSeconds   = arrivalOffsets.values / np.timedelta64(1, 's')
+        departureSeconds = departureOffsets.values / np.timedelta64(1, 's')
+        
+        # dwell times are zero at the start and end of the line
+        dwellTimes = np.where((sol==1) | (eol==1), 0.0, 
+                              np.round((departureSeconds - arrivalSeconds) / 60.0, 2))
+        
+        # runtimes are from the departure at the previous stop on the same trip
+        lastDepartureSeconds = np.roll(departureSeconds, 1)
+        runtimes = np.where(sol==1, 0.0, 
+                            np.maximum(0, np.round((arrivalSeconds - lastDepartureSeconds) / 60.0, 2)))
+        
+        # total time is sum of runtime and dwell time
+        tottimes = runtimes + dwellTimes
+        
+        # speed (mph), rounded with the built-in round because np.round 
+        # breaks exact ties differently and would change the published values
+        with np.errstate(divide='ignore', invalid='ignore'): 
+            runSpeeds = np.where(runtimes > 0, serviceMiles / (runtimes / 60.0), 0.0)
+            totSpeeds = np.where(tottimes > 0, serviceMiles / (tottimes / 60.0), 0.0)
+        runSpeeds = np.array([round(speed, 2) for speed in runSpeeds], dtype=np.float64)
+        totSpeeds = np.array([round(speed, 2) for speed in totSpeeds], dtype=np.float64)
                                     
         # convert to data frame 
-        print ("service_id %s has %i trip-stop records" % (period.service_id, len(data)))
-        df = pd.DataFrame(data)    
+        print ("service_id %s has %i trip-stop records" % (period.service_id, n))
+        df = pd.DataFrame(OrderedDict([
+                # calendar attributes
+                ('MONTH'            , startDate), 
+                ('DATE'             , startDate), 
+                ('DOW'              , dow), 
+                ('TOD'              , tod), 
+                # observations
+                ('TRIP_STOPS'       , 1), 
+                ('OBSERVED'         , 0), 
+                # For matching to AVL data
+                ('AGENCY_ID'        , agencyId), 
+                ('ROUTE_SHORT_NAME' , routeShortName), 
+                ('ROUTE_LONG_NAME'  , routeLongName), 
+                ('DIR'              , direction), 
+                ('TRIP'             , tripName), 
+                ('SEQ'              , seq), 
+                # route/trip attributes
+                ('ROUTE_TYPE'       , routeType), 
+                ('TRIP_HEADSIGN'    , tripHeadsign), 
+                ('HEADWAY_S'        , np.NaN),            # calculated below
+                ('FARE'             , fares), 
+                # stop attributes
+                ('STOPNAME'         , stopName), 
+                ('STOP_LAT'         , stopLat), 
+                ('STOP_LON'         , stopLon), 
+                ('SOL'              , sol), 
+                ('EOL'              , eol), 
+                # stop times 
+                ('ARRIVAL_TIME_S'   , arrivalTimes), 
+                ('DEPARTURE_TIME_S' , departureTimes), 
+                ('DWELL_S'          , dwellTimes), 
+                ('RUNTIME_S'        , runtimes), 
+                ('TOTTIME_S'        , tottimes), 
+                ('SERVMILES_S'      , serviceMiles), 
+                ('RUNSPEED_S'       , runSpeeds), 
+                ('TOTSPEED_S'       , totSpeeds), 
+                # indicates range this schedule is in operation  
+                ('SCHED_DATES'      , dateRangeString), 
+                # gtfs IDs
+                ('ROUTE_ID'         , routeId), 
+                ('TRIP_ID'          , tripId), 
+                ('STOP_ID'          , stopId), 
+                ('SERVICE_ID'       , serviceIdString)
+                ]))
 
         # calculate the headways, based on difference in previous bus on 
         # this route stopping at the same stop
@@ -542,9 +702,9 @@ class GTFSHelper():
         return df
         
     
-    def getShapeLine(self, shape_id, stopTimeList):
+    def getShapeLine(self, shape_id, stopPoints):
         """
-        Accepts a shape_id and a list of stop times in GTFS transit feed format.
+        Accepts a shape_id and a list of (x, y) stop locations, in order.
         If not shape is provided, then just project straight lines between
         each stop.  
         
@@ -555,11 +715,6 @@ class GTFSHelper():
         """
 
         # first create a LineString from the stops, which are in the right order
-        stopPoints = []
-        for stopTime in stopTimeList:
-            x, y = convertLongitudeLatitudeToXY((stopTime.stop.stop_lon, stopTime.stop.stop_lat))
-            stopPoints.append((x, y))
-        
         if len(stopPoints)>1: 
             stopLine = LineString(stopPoints)
         
@@ -572,8 +727,10 @@ class GTFSHelper():
         
         # then project each point onto that stopLine
         shapePointDict = {}
-        for p in shape.points: 
-            x, y = convertLongitudeLatitudeToXY((p[1], p[0]))
+        xs, ys = convertLongitudeLatitudeToXYVec(
+                    [p[1] for p in shape.points], 
+                    [p[0] for p in shape.points])
+        for p, x, y in zip(shape.points, xs, ys): 
             if len(stopPoints)>1: 
                 projectedDist = stopLine.project(Point(x, y), normalized=True)
             else:                
@@ -25,12 +25,14 @@ __license__     = """
 
 import sys
 import dta
+import itertools
 import math
 import operator
 import numpy as np
 import scipy as sp
 import pandas as pd
 from scipy.sparse import csr_matrix
+from scipy.spatial import cKDTree
 from pyproj import Proj
 from mm.path_inference.structures import State
 from mm.path_inference.structures import Path 
@@ -50,19 +52,23 @@ except(WindowsError):
            
     raise
 
+# numba compiles the shortest path trace, but is optional.  Without it, 
+# the same function runs as regular python. 
+try: 
+    from numba import njit
+except ImportError: 
+    def njit(*args, **kwargs):
+        def decorator(func):
+            return func
+        return decorator
 
-def convertLongitudeLatitudeToXY(lon_lat):        
-    """
-    Converts longitude and latitude to an x,y coordinate pair in
-    NAD83 Datum (most of our GIS and CUBE files)
-    
-    Returns (x,y) in feet.
-    """
-    FEET_TO_METERS = 0.3048006096012192
-    
-    (longitude,latitude) = (lon_lat)
 
-    p = Proj(proj  = 'lcc',
+FEET_TO_METERS = 0.3048006096012192
+
+# NAD83 Datum, California State Plane Zone III (most of our GIS and CUBE files).
+# Set up once, because initializing the projection is much slower than 
+# converting a point.  
+SF_PROJ = Proj(proj  = 'lcc',
             datum = "NAD83",
             lon_0 = "-120.5",
             lat_1 = "38.43333333333",
@@ -72,26 +78,73 @@ def convertLongitudeLatitudeToXY(lon_lat):
             units = "m",
             x_0   = 2000000,
             y_0   = 500000) #use kwargs
-    x_meters,y_meters = p(longitude,latitude,inverse=False,errcheck=True)
+
+
+def convertLongitudeLatitudeToXY(lon_lat):        
+    """
+    Converts longitude and latitude to an x,y coordinate pair in
+    NAD83 Datum (most of our GIS and CUBE files)
+    
+    Returns (x,y) in feet.
+    """
+    
+    (longitude,latitude) = lon_lat
+
+    x_meters,y_meters = SF_PROJ(longitude,latitude,inverse=False,errcheck=True)
 
     return (x_meters/FEET_TO_METERS,y_meters/FEET_TO_METERS)
 
+
+def convertLongitudeLatitudeToXYVec(longitude, latitude):        
+    """
+    Converts arrays of longitude and latitude to x,y coordinates in
+    NAD83 Datum (most of our GIS and CUBE files)
+    
+    Returns (x,y) arrays in feet.
+    """
+    
+    x_meters,y_meters = SF_PROJ(np.asarray(longitude, dtype=np.float64),
+                                np.asarray(latitude, dtype=np.float64),
+                                inverse=False,errcheck=True)
+
+    return (x_meters/FEET_TO_METERS,y_meters/FEET_TO_METERS)
+
+# a rectangular box drawn around the City of San Francisco, 
+# as (xmin, ymin, xmax, ymax) in feet
+SF_BBOX = (5979762.10716, 2074908.26203, 6027567.22925, 2130887.56530)
+
+
 def isInSanFranciscoBox(x_y):    
     """
     Checks whether the x_y point given is within a rectangular box
     drawn around the City of San Francisco.
     """
     (x, y) = x_y
+    (xmin, ymin, xmax, ymax) = SF_BBOX
     
-    if (x > 5979762.10716
-    and y > 2074908.26203
-    and x < 6027567.22925
-    and y < 2130887.56530):
+    if (x > xmin
+    and y > ymin
+    and x < xmax
+    and y < ymax):
         return True
     else: 
         return False
 
 
+def isInSanFranciscoBoxVec(x, y):    
+    """
+    Checks whether each of the points given by arrays x and y is within 
+    a rectangular box drawn around the City of San Francisco.
+    
+    Returns a boolean array. 
+    """
+    x = np.asarray(x)
+    y = np.asarray(y)
+    (xmin, ymin, xmax, ymax) = SF_BBOX
+    
+    return (x > xmin) & (y > ymin) & (x < xmax) & (y < ymax)
+
+
 def distanceInFeet(position1, position2): 
     """
     Accepts two GPS positions
@@ -99,10 +152,51 @@ def distanceInFeet(position1, position2):
     Returns the distance between the two points.  
     """
         
-    dist = math.sqrt(((position1.x-position2.x)**2) 
-                   + ((position1.y-position2.y)**2))
+    dist = math.hypot(position1.x-position2.x, position1.y-position2.y)
     return dist
+
+
+def distanceInFeetVec(pos1_xy, pos2_xy): 
+    """
+    Accepts two arrays of positions, each with shape (N,2) and 
+    columns x, y. 
+    
+    Returns an array of the N distances between the points.  
+    """
+    
+    pos1_xy = np.asarray(pos1_xy, dtype=np.float64)
+    pos2_xy = np.asarray(pos2_xy, dtype=np.float64)
+    return np.hypot(pos1_xy[:,0]-pos2_xy[:,0], pos1_xy[:,1]-pos2_xy[:,1])
                  
+
+
+@njit(cache=True)
+def tracePath(predRow, start, end):
+    """
+    Accepts a row of a predecessor matrix, and the start and end 
+    graph indices.  
+    
+    Returns an array of the graph indices on the shortest path, 
+    in order from start to end. 
+    """
+    
+    # count the links first, so only the path itself is allocated
+    n = 1
+    j = end
+    while (j != start):
+        n += 1
+        j = predRow[j]
+    
+    # fill from the back, because we start from the end
+    path = np.empty(n, np.int64)
+    j = end
+    for k in range(n-1, 0, -1):
+        path[k] = j
+        j = predRow[j]
+    path[0] = start
+    
+    return path
+    
                            
 class HwyNetwork():
     """ 
@@ -122,6 +216,12 @@ class HwyNetwork():
     # also, the GPS error seems to be about 60 ft, so it should be at 
     # least that much
     PROJECT_DIST_THRESHOLD = 150.0    # feet
+    
+    # links whose box is larger than this distance from its center to a
+    # corner are left out of the k-d tree used for projecting, so that a 
+    # few long links don't widen the search around every point.  Instead, 
+    # they are checked directly against each point. 
+    PROJECT_TREE_MAX_RADIUS = 500.0   # feet
 
     # turn penalties are used when calculating shortest paths on links
     # (but not on nodes), and discourage zig-zag paths through the grid
@@ -139,6 +239,10 @@ class HwyNetwork():
     # to that limit. 
     TIME_LIMIT_FACTOR = 2.0
     TIME_LIMIT_MINIMUM = 60.0
+    
+    # the skim is stored as whole seconds in 32-bit integers to save memory, 
+    # and this value is used in place of infinity where there is no path
+    NO_PATH = np.iinfo(np.int32).max
 
     def __init__(self):
         """
@@ -153,6 +257,29 @@ class HwyNetwork():
         # It is used for fast nearest neighbour queries
         self.linkSpatialIndex = None
         
+        # This is a k-d tree of the center of each road link's bounding 
+        # box, used to project many GPS points in a single query.  
+        # linkTreeIds gives the ID of each link, and linkTreeBoxes gives
+        # its box as (xmin, ymin, xmax, ymax).  linkTreeIndices gives the
+        # link index of each point in the tree, and linkTreeRadius is the 
+        # largest distance from a center to the corner of its box.  The 
+        # long links are not in the tree, and their indices are in 
+        # linkTreeLongIndices.
+        self.linkTree = None
+        self.linkTreeIds = None
+        self.linkTreeBoxes = None
+        self.linkTreeIndices = None
+        self.linkTreeLongIndices = None
+        self.linkTreeRadius = 0.0
+        
+        # a dictionary lookup between the link IDs and the road link 
+        # objects, which is faster than going through the network
+        self.linkById = None
+        
+        # a dictionary lookup between the link IDs and the free-flow
+        # travel time on that link, in seconds
+        self.linkFFTimes = None
+        
         """
         These options are for building shortest paths between nodes.  The 
         paths between nodes do not consider turn restrictions or penalties. 
@@ -187,8 +314,13 @@ class HwyNetwork():
         self.l2i = None
         self.i2l = None
         
+        # the same lookup from graph index to link ID, as an array so 
+        # a whole path can be converted at once
+        self.i2lArray = None
+        
         # The N x N matrix of costs between graph links. skim[i,j] gives 
-        # the shortest cost from link i to link j along the graph.
+        # the shortest cost from link i to link j along the graph, in 
+        # seconds, or NO_PATH if there is no path.
         self.linkSkim = None
         
         # The N x N matrix of predecessors, which can be used to reconstruct 
@@ -197,6 +329,12 @@ class HwyNetwork():
         # gives the index of the previous link in the path from point i to point j. 
         # If no path exists between point i and j, then predecessors[i, j] = -9999
         self.linkPred = None
+        
+        # If the shortest paths are only calculated from some source links, 
+        # skim and pred have one row for each source, and this array gives
+        # the row for each graph index, or -1 if it is not a source.  
+        # It is None if all links are sources. 
+        self.linkSkimRows = None
 
 
     def readDTANetwork(self, inputDir, filePrefix, logging_dir='C:/temp'):
@@ -222,15 +360,44 @@ class HwyNetwork():
         dta.Algorithms.ShortestPaths.initialiseMovementCostsWithFFTT(net)        
         
         self.net = net
+        
+        self.initializeLinkLookups()
 
+    
+    def initializeLinkLookups(self):
+        """
+        Populates self.linkById with each road link, and self.linkFFTimes 
+        with the free-flow travel time of each road link in seconds, so 
+        they can be looked up directly when projecting points and 
+        calculating path times. 
+        """
         
-    def initializeShortestPathsBetweenLinks(self):
+        self.linkById = {}
+        self.linkFFTimes = {}
+        for link in self.net.iterRoadLinks():
+            self.linkById[link.getId()] = link
+            self.linkFFTimes[link.getId()] = 60.0 * link.getFreeFlowTTInMin()
+    
+    
+    def getLink(self, link_id):
+        """
+        Returns the road link with the given ID. 
+        """
+        return self.linkById[link_id]
+
+        
+    def initializeShortestPathsBetweenLinks(self, sourceLinks=None):
         """
         Calculates the shortest paths between all link pairs and populates
         self.linkSkim and self.linkPred
 
         The paths between links consider turn restrictions or penalties based 
         on the movements in the network. 
+        
+        sourceLinks - optional, non-empty list of link IDs.  If given, only 
+                      the paths starting from these links are calculated, 
+                      which takes much less time and memory than all pairs. 
+                      By default, all pairs are calculated. 
         """
         
         # STEP 1: create a dictionary lookup between the node IDs and
@@ -244,13 +411,20 @@ class HwyNetwork():
             self.l2i[link_id] = i
             self.i2l[i] = link_id
             i += 1
-        num_links = i+1
+        num_links = i
+        
+        self.i2lArray = np.array([self.i2l[k] for k in range(num_links)], dtype=np.int64)
         
         # STEP 2: create a compressed sparse matrix representation of the network, 
         # for use with scipy shortest path algorithms
-        alinks = []
-        blinks = []
-        costs = []
+        # allocate enough space for all movements, and trim to the 
+        # road link movements afterwards
+        max_movements = sum(1 for movement in self.net.iterMovements())
+        alinks = np.empty(max_movements, dtype=np.int32)
+        blinks = np.empty(max_movements, dtype=np.int32)
+        costs  = np.empty(max_movements, dtype=np.float64)
+        
+        m = 0
         for movement in self.net.iterMovements():
             
             incomingLink = movement.getIncomingLink()
@@ -274,24 +448,56 @@ class HwyNetwork():
                 elif movement.isUTurn():
                     cost += self.U_TURN_PENALTY
             
-                # and add to my lists
-                alinks.append(a)
-                blinks.append(b)
-                costs.append(cost)
+                # and add to my arrays
+                alinks[m] = a
+                blinks[m] = b
+                costs[m]  = cost
+                m += 1
         
-        num_movements = len(costs)
-        
-        alinks2 = np.array(alinks)
-        blinks2 = np.array(blinks)
-        costs2  = np.array(costs)
+        num_movements = m
         
         print ('Creating network graph with %i links and %i movements'  %(num_links, num_movements))     
-        graph = csr_matrix((costs2, (alinks2, blinks2)), shape=(num_links, num_links)) 
+        graph = csr_matrix((costs[:m], (alinks[:m], blinks[:m])), shape=(num_links, num_links)) 
         
         
         # STEP 3: run the scipy algorithm
-        (self.linkSkim, self.linkPred) = sp.sparse.csgraph.shortest_path(graph, 
-                        method='auto', directed=True, return_predecessors=True)
+        if (sourceLinks is None): 
+            self.linkSkimRows = None
+            (self.linkSkim, self.linkPred) = sp.sparse.csgraph.shortest_path(graph, 
+                            method='auto', directed=True, return_predecessors=True)
+        else: 
+            sources = np.unique(np.asarray([self.l2i[link_id] for link_id in sourceLinks], 
+                                           dtype=np.intp))
+            if (len(sources)==0): 
+                raise ValueError('No source links given for shortest paths')
+            self.linkSkimRows = np.full(num_links, -1, dtype=np.int32)
+            self.linkSkimRows[sources] = np.arange(len(sources), dtype=np.int32)
+            (self.linkSkim, self.linkPred) = sp.sparse.csgraph.dijkstra(graph, 
+                            directed=True, indices=sources, return_predecessors=True)
+        
+        # STEP 4: store the costs as whole seconds.  The missing paths are
+        # marked and the costs rounded in place, but the conversion needs
+        # one int32 copy alongside the float matrix, so only the skim that 
+        # is kept afterwards is half the size. 
+        np.nan_to_num(self.linkSkim, copy=False, posinf=self.NO_PATH)
+        np.round(self.linkSkim, out=self.linkSkim)
+        self.linkSkim = self.linkSkim.astype(np.int32)
+        
+    
+    def getSkimRow(self, start):
+        """
+        Returns the row of self.linkSkim and self.linkPred for the 
+        paths starting from graph index start. 
+        """
+        
+        if (self.linkSkimRows is None): 
+            return start
+        
+        row = self.linkSkimRows[start]
+        if (row < 0): 
+            raise ValueError('Shortest paths not calculated from link ' 
+                             + str(self.i2l[start]))
+        return row
         
     
     def project(self, gps_pos):
@@ -301,8 +507,102 @@ class HwyNetwork():
         return_tuple = self.findNRoadLinksNearestCoords(gps_pos.x, gps_pos.y, 
             n=self.PROJECT_NUM_LINKS, dist_limit=self.PROJECT_DIST_THRESHOLD)
             
+        return self.createStates(return_tuple)
+    
+    
+    def projectBatch(self, x, y):
+        """ Projects a sequence of GPS positions at once.  
+        
+        x, y - arrays of the GPS coordinates, in :py:attr:`Node.COORDINATE_UNITS`
+        
+        Returns a list with one list of states for each GPS position, 
+        equivalent to calling project() on each. 
+        
+        A single query of a k-d tree of link centers finds every link whose 
+        bounding box could be within the threshold of each point, and the 
+        few long links are added to that.  Of those, the PROJECT_NUM_LINKS 
+        nearest boxes are kept, as the rtree would, and then the exact 
+        distance is calculated for each.  
+        """
+        
+        if (self.linkTree==None):
+            self.initializeLinkTree()
+            
+        points = np.column_stack((np.asarray(x, dtype=np.float64), 
+                                  np.asarray(y, dtype=np.float64)))
+        numPoints = len(points)
+        
+        # a link within the threshold can have its center up to the 
+        # radius further away than that
+        candidatesList = self.linkTree.query_ball_point(points, 
+                r=self.PROJECT_DIST_THRESHOLD + self.linkTreeRadius)
+        
+        # flatten to one record for each point and candidate link, 
+        # and check the long links against every point
+        counts = np.fromiter((len(c) for c in candidatesList), dtype=np.intp, count=numPoints)
+        pointIdx = np.repeat(np.arange(numPoints), counts)
+        linkIdx = self.linkTreeIndices[np.fromiter(itertools.chain.from_iterable(candidatesList), 
+                                                   dtype=np.intp, count=counts.sum())]
+        numLong = len(self.linkTreeLongIndices)
+        if (numLong > 0): 
+            pointIdx = np.concatenate((pointIdx, np.repeat(np.arange(numPoints), numLong)))
+            linkIdx = np.concatenate((linkIdx, np.tile(self.linkTreeLongIndices, numPoints)))
+        
+        # distance from each point to each candidate box, where a box beyond
+        # the threshold cannot hold a link within it
+        boxes = self.linkTreeBoxes[linkIdx]
+        px = points[pointIdx, 0]
+        py = points[pointIdx, 1]
+        dx = np.maximum(np.maximum(boxes[:,0] - px, px - boxes[:,2]), 0.0)
+        dy = np.maximum(np.maximum(boxes[:,1] - py, py - boxes[:,3]), 0.0)
+        boxDists = np.hypot(dx, dy)
+        
+        keep = boxDists < self.PROJECT_DIST_THRESHOLD
+        pointIdx = pointIdx[keep]
+        linkIdx = linkIdx[keep]
+        boxDists = boxDists[keep]
+        
+        # group by point, nearest box first
+        order = np.lexsort((boxDists, pointIdx))
+        pointIdx = pointIdx[order]
+        linkIdx = linkIdx[order]
+        boxDists = boxDists[order]
+        bounds = np.searchsorted(pointIdx, np.arange(numPoints + 1))
+        
+        statesList = []
+        for p in range(numPoints):
+            (px, py) = points[p]
+            
+            # keep the nearest boxes, including any ties
+            candidates = linkIdx[bounds[p]:bounds[p+1]]
+            candidateDists = boxDists[bounds[p]:bounds[p+1]]
+            if len(candidates) > self.PROJECT_NUM_LINKS: 
+                nthDist = candidateDists[self.PROJECT_NUM_LINKS-1]
+                candidates = candidates[candidateDists <= nthDist]
+            
+            return_tuples = []
+            for idx in candidates: 
+                link = self.getLink(self.linkTreeIds[idx])
+                (dist, t) = link.getDistanceFromPoint(px, py)
+                if dist < self.PROJECT_DIST_THRESHOLD:
+                    return_tuples.append( (link, dist, t))
+            
+            # sort and kick out extras
+            return_tuples = sorted(return_tuples, key=operator.itemgetter(1))
+            return_tuples = return_tuples[:self.PROJECT_NUM_LINKS]
+            
+            statesList.append(self.createStates(return_tuples))
+                    
+        return statesList
+    
+    
+    def createStates(self, return_tuples):
+        """ Converts a list of (roadlink, distance, t) tuples, as returned 
+        by findNRoadLinksNearestCoords(), to a list of states. 
+        """
+        
         states = []
-        for rt in return_tuple: 
+        for rt in return_tuples: 
             (roadlink, distance, t) = rt
             offset = t * roadlink.getLengthInCoordinateUnits()
             state = State(roadlink.getId(), offset, distFromGPS=distance)
@@ -346,7 +646,7 @@ class HwyNetwork():
         link_ids = self.linkSpatialIndex.nearest((x, x, y, y), n)
 
         for link_id in link_ids:
-            link = self.net.getLinkForId(link_id)
+            link = self.getLink(link_id)
 
             (dist, t) = link.getDistanceFromPoint(x,y)
             if dist < dist_limit:
@@ -387,6 +687,43 @@ class HwyNetwork():
             
             self.linkSpatialIndex.insert(link.getId(), (min(x), max(x), min(y), max(y)))
                         
+    
+    def initializeLinkTree(self):
+        """
+        Creates a k-d tree of the center of each link's bounding box, 
+        for projecting many points with projectBatch().  The long links
+        are kept out of the tree and listed separately. 
+        
+        """
+        
+        ids = []
+        boxes = []
+        for link in self.net.iterRoadLinks():
+            
+            # use the same box as the spatial index
+            coords = link.getCenterLine(wholeLineShapePoints = True)
+            x, y = zip(*coords)
+            
+            ids.append(link.getId())
+            boxes.append((min(x), min(y), max(x), max(y)))
+        
+        self.linkTreeIds = np.array(ids)
+        self.linkTreeBoxes = np.array(boxes, dtype=np.float64)
+        
+        centers = (self.linkTreeBoxes[:,0:2] + self.linkTreeBoxes[:,2:4]) / 2.0
+        halfDiagonals = np.hypot(self.linkTreeBoxes[:,2] - self.linkTreeBoxes[:,0], 
+                                 self.linkTreeBoxes[:,3] - self.linkTreeBoxes[:,1]) / 2.0
+        
+        isLong = halfDiagonals > self.PROJECT_TREE_MAX_RADIUS
+        self.linkTreeIndices = np.flatnonzero(~isLong)
+        self.linkTreeLongIndices = np.flatnonzero(isLong)
+        
+        self.linkTree = cKDTree(centers[self.linkTreeIndices])
+        if (len(self.linkTreeIndices) > 0): 
+            self.linkTreeRadius = halfDiagonals[self.linkTreeIndices].max()
+        else: 
+            self.linkTreeRadius = 0.0
+        
         
 
     def getPaths(self, s1, s2, timeLimit=sys.maxsize):
@@ -435,21 +772,15 @@ class HwyNetwork():
         end = self.l2i[endLink]
         
         # if there is no valid path
-        if (self.linkSkim[start, end] > timeLimit):
+        row = self.getSkimRow(start)
+        cost = self.linkSkim[row, end]
+        if (cost == self.NO_PATH or cost > timeLimit):
             return []
         
-        # trace the path
-        path = []
-        j = end
-        while (j != start):
-            path.append(self.i2l[j])
-            j = self.linkPred[start, j]
-        path.append(self.i2l[start])
-        
-        # reverse the list, because we started from the end
-        path.reverse()
+        # trace the path using the indices, and only convert to IDs at the end
+        path = tracePath(self.linkPred[row], start, end)
             
-        return path
+        return self.i2lArray[path].tolist()
 
 
     def getPathsBetweenCollections(self, sc1, sc2):
@@ -459,22 +790,36 @@ class HwyNetwork():
         - s1 : a StateCollection object
         - s2 : a StateCollection object
         """
+        n1 = len(sc1.states)
+        n2 = len(sc2.states)
+        
+        # limit possible paths based on a max time diff
+        timeDiff = (sc2.time - sc1.time).total_seconds()
+        timeLimit = self.TIME_LIMIT_FACTOR * timeDiff
+        timeLimit = max(self.TIME_LIMIT_MINIMUM, timeLimit)
+        
+        # get the paths, in order of i1 then i2
+        ps_list = [self.getPaths(s1, s2, timeLimit=timeLimit) 
+                   for s1 in sc1.states for s2 in sc2.states]
+        
+        # if there is exactly one path for each pair, the transitions 
+        # are just every combination of states, so build them all at once
+        if all(len(ps)==1 for ps in ps_list):
+            idx = np.arange(n1 * n2)
+            (i1_arr, i2_arr) = np.divmod(idx, n2)
+            trans1 = list(zip(i1_arr.tolist(), idx.tolist()))
+            trans2 = list(zip(idx.tolist(), i2_arr.tolist()))
+            paths = [ps[0] for ps in ps_list]
+            return (trans1, paths, trans2)
+        
+        # otherwise, number the paths one at a time
         trans1 = []
         trans2 = []
         paths = []
-        n1 = len(sc1.states)
-        n2 = len(sc2.states)
         num_paths = 0
         for i1 in range(n1):
             for i2 in range(n2):
-                
-                # limit possible paths based on a max time diff
-                timeDiff = (sc2.time - sc1.time).total_seconds()
-                timeLimit = self.TIME_LIMIT_FACTOR * timeDiff
-                timeLimit = max(self.TIME_LIMIT_MINIMUM, timeLimit)
-                
-                # get the paths
-                ps = self.getPaths(sc1.states[i1], sc2.states[i2], timeLimit=timeLimit)
+                ps = ps_list[i1 * n2 + i2]
                 for path in ps:
                     trans1.append((i1, num_paths))
                     trans2.append((num_paths, i2))
@@ -492,14 +837,23 @@ class HwyNetwork():
         # get the traversal ratios
         traversalRatios = self.getPathTraversalRatios(path)
         
-        # frist get the total time across all links
-        tot_tt = 0.0
-        for i in range(0,len(path.links)):
-            link = self.net.getLinkForId(path.links[i])
-            tot_tt += 60.0 * link.getFreeFlowTTInMin() * traversalRatios[i]
+        # the total time across all links
+        ff_times = self.getPathLinkFreeFlowTimes(path)
+        tot_tt = float(np.dot(ff_times, traversalRatios))
                 
         return tot_tt
     
+    
+    def getPathLinkFreeFlowTimes(self, path):
+        """ Returns an array of the full free-flow travel time in seconds 
+        of each link in the path.
+        
+        Arguments: a path_inference.structures.Path object
+        """
+        
+        return np.fromiter((self.linkFFTimes[link_id] for link_id in path.links), 
+                           dtype=np.float64, count=len(path.links))
+    
 
     def getPathFreeFlowTTInSecondsWithTurnPenalties(self, path):
         """ Returns the free-flow travel time of the path in seconds, 
@@ -511,17 +865,19 @@ class HwyNetwork():
         # the skim time includes turn penalties, so start from there
         startLinkId = path.links[0]
         endLinkId = path.links[-1]        
-        skimTime = self.linkSkim[self.l2i[startLinkId], self.l2i[endLinkId]]
+        skimTime = self.linkSkim[self.getSkimRow(self.l2i[startLinkId]), self.l2i[endLinkId]]
+        if (skimTime == self.NO_PATH): 
+            skimTime = np.inf
+        else: 
+            skimTime = float(skimTime)
         
         # adjust the first element, only for the traversal portion of the travel time
         firstOffsetRatio = self.getLinkOffsetRatio(path.start)
-        firstLink = self.net.getLinkForId(startLinkId)
-        firstLinkTime = 60.0 * firstLink.getFreeFlowTTInMin()
+        firstLinkTime = self.linkFFTimes[startLinkId]
         
         # adjust the last element, only for the traversal portion of the travel time
         lastOffsetRatio = self.getLinkOffsetRatio(path.end)
-        lastLink = self.net.getLinkForId(endLinkId)
-        lastLinkTime = 60.0 * lastLink.getFreeFlowTTInMin()
+        lastLinkTime = self.linkFFTimes[endLinkId]
         
         tt = (skimTime 
             - (firstOffsetRatio * firstLinkTime) 
@@ -535,7 +891,7 @@ class HwyNetwork():
         offset ratio is in [0,1] and indicates how far along from the 
         start point and end point
         """
-        link = self.net.getLinkForId(state.link_id)
+        link = self.getLink(state.link_id)
         dist = link.getLengthInCoordinateUnits()
         ratio = state.offset / dist
         return ratio
@@ -550,24 +906,24 @@ class HwyNetwork():
         """
         
         if (len(path.links)==0):
-            return []
+            return np.empty(0, dtype=np.float64)
                 
         # start with an array of 1s
-        ratios = [1.0] * len(path.links)
+        ratios = np.ones(len(path.links), dtype=np.float64)
         
         # adjust the first element        
         firstOffsetRatio = self.getLinkOffsetRatio(path.start)
-        ratios[0] = ratios[0] - firstOffsetRatio
+        ratios[0] -= firstOffsetRatio
         
         # adjust the last element
         lastOffsetRatio = self.getLinkOffsetRatio(path.end)
-        ratios[len(path.links)-1] = ratios[len(path.links)-1] - (1.0-lastOffsetRatio)
+        ratios[-1] -= (1.0-lastOffsetRatio)
         
         return ratios        
         
 
     def allocatePathTravelTimeToLinks(self, path, start_time, end_time):
-        """ Returns three lists for: 
+        """ Returns three arrays for: 
             
             (link_id, traversalRatio, travelTime)
             
@@ -583,31 +939,27 @@ class HwyNetwork():
                    a datetime object for the end time
         """
                 
-        # get the traversal ratios
+        # get the traversal ratios and free-flow times in a single pass
+        # over the links
+        link_ids = np.array(path.links)
         traversalRatios = self.getPathTraversalRatios(path)
+        ff_times = self.getPathLinkFreeFlowTimes(path) * traversalRatios
         
         # get the totals
         tot_tt = (end_time - start_time).total_seconds()
-        tot_ff_time = self.getPathFreeFlowTTInSeconds(path)
+        tot_ff_time = ff_times.sum()
         
         # allocate the travel time
-        link_tt = []
-        for i in range(0,len(path.links)):
-            
-            # if the vehicle is stopped, or effectively stopped
-            # then allocate the travel time equally across all links
-            if (tot_ff_time < 0.1): 
-                tt = tot_tt * (1.0/len(path.links))
-
-            # othwerwise make it proportional to the free-flow times
-            else: 
-                link = self.net.getLinkForId(path.links[i])
-                ff_time = 60.0 * link.getFreeFlowTTInMin() * traversalRatios[i]
-                tt = tot_tt * (ff_time / tot_ff_time)
-                
-            link_tt.append(tt)        
+        # if the vehicle is stopped, or effectively stopped
+        # then allocate the travel time equally across all links
+        if (tot_ff_time < 0.1): 
+            link_tt = np.full(len(link_ids), tot_tt / max(1, len(link_ids)))
+
+        # othwerwise make it proportional to the free-flow times
+        else: 
+            link_tt = tot_tt * (ff_times / tot_ff_time)
         
-        return (path.links, traversalRatios, link_tt)
+        return (link_ids, traversalRatios, link_tt)
         
     
     def getRoadLinkDataFrame(self):
@@ -680,7 +1032,7 @@ class HwyNetwork():
             self.n2i[node_id] = i
             self.i2n[i] = node_id
             i += 1
-        num_nodes = i+1
+        num_nodes = i
         
         # STEP 2: create a compressed sparse matrix representation of the network, 
         # for use with scipy shortest path algorithms
@@ -383,12 +383,13 @@ class SFMuniDataHelper():
         self.routeEquiv = df
         
     
-    def processRawData(self, infile, outfile):
+    def processRawData(self, infile, store):
         """
         Read SFMuniData, cleans it, processes it, and writes it to an HDF5 file.
         
         infile  - in "raw STP" format
-        outfile - output file name in h5 format
+        store   - an open HDFStore to write to, which the caller is 
+                  responsible for closing
         """
         
         print (datetime.datetime.now().ctime(), 'Converting raw data in file: ', infile)
@@ -429,9 +430,6 @@ class SFMuniDataHelper():
                              chunksize= self.CHUNKSIZE, 
                              na_values=['ID'])             # because of headers in middle of file
 
-        # establish the writer
-        store = pd.HDFStore(outfile)
-
         # iterate through chunk by chunk so we don't run out of memory
         rowsRead    = 0
         rowsWritten = 0
@@ -548,9 +546,6 @@ class SFMuniDataHelper():
             rowsWritten += len(df)
             print(datetime.datetime.now().ctime(), ' Read %i rows and kept %i rows.' % (rowsRead, rowsWritten))
 
-        # close the writer
-        store.close()
-
       
     def cleanPart2(self, infile, outfile):
         """
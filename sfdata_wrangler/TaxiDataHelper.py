@@ -28,7 +28,6 @@ import numpy as np
 import datetime
 import HwyNetwork
 from Trajectory import Trajectory
-from mm.path_inference.structures import Position
 
 
 def setNumPointsAndLength(df):
@@ -139,12 +138,11 @@ class TaxiDataHelper():
             rowsRead    += len(chunk)
         
             # convert to x y coordinates
-            lon_lat = pd.Series(list(zip(chunk['longitude'], chunk['latitude'])), index=chunk.index)
-            x_y = lon_lat.apply(HwyNetwork.convertLongitudeLatitudeToXY)
-            chunk['x'], chunk['y'] = zip(*x_y)
+            chunk['x'], chunk['y'] = HwyNetwork.convertLongitudeLatitudeToXYVec(
+                                        chunk['longitude'].values, chunk['latitude'].values)
             
             # keep only the points within the city bounds
-            chunk['in_sf'] = x_y.apply(HwyNetwork.isInSanFranciscoBox)
+            chunk['in_sf'] = HwyNetwork.isInSanFranciscoBoxVec(chunk['x'].values, chunk['y'].values)
             chunk = chunk[chunk['in_sf']==True]
         
             # convert to timedate formats
@@ -166,12 +164,14 @@ class TaxiDataHelper():
         store.close()
     
     
-    def identifyGPSTrips(self, storefile, inkey, outkey):
+    def identifyGPSTrips(self, storefile, inkey, outkey, max_cabs=None):
         """
         Reads the GPS points and creates a sequence of points for each
         taxi trip.  
         
         storefile - HDF datastore with GPS points in it. 
+        max_cabs  - if set, only process this many cabs.  For quick 
+                    testing only, the default processes all of them. 
         """
 
         # open the data store
@@ -184,8 +184,8 @@ class TaxiDataHelper():
         cab_ids = store.select_column(inkey, 'cab_id').unique()
         cab_ids.sort_values()
         
-        # for testing only
-        #cab_ids = cab_ids[:5]
+        if max_cabs is not None: 
+            cab_ids = cab_ids[:max_cabs]
 
         print ('Retrieved a total of %i days to process' % len(dates))
         
@@ -208,11 +208,16 @@ class TaxiDataHelper():
                     df['speed']   = 0
                     df['forward_stationary_time'] = 0
                     df['backward_stationary_time'] = 0
+                    
+                    # distance from the previous point, calculated all at once
+                    xy = df[['x','y']].values
+                    point_feet = np.zeros(len(df))
+                    point_feet[1:] = HwyNetwork.distanceInFeetVec(xy[:-1], xy[1:])
                                     
                     # sort out whether the vehicle is moving, and how to group trips
                     first_row = True
                     last_row = None
-                    for i, row in df.iterrows():
+                    for p, (i, row) in enumerate(df.iterrows()):
         
                         # reset for each new vehicle
                         if (first_row):
@@ -221,9 +226,7 @@ class TaxiDataHelper():
                             
                         # for these, calculate measures and increment trip_ids
                         else:
-                            pos1 = Position(last_row['x'],last_row['y'])
-                            pos2 = Position(row['x'], row['y'])
-                            feet = HwyNetwork.distanceInFeet(pos1, pos2)
+                            feet = point_feet[p]
                             
                             seconds = (row['time'] - last_row['time']).total_seconds()
                             speed = (feet / seconds) * 0.681818
@@ -138,11 +138,12 @@ class Trajectory():
         self.most_likely_indices = None
 
 
-        # STEP 1: Create the points
+        # STEP 1: Create the points, projecting them all at once
+        statesList = hwynet.projectBatch(df['x'].values, df['y'].values)
+        
         firstRow = True
-        for i, row in df.iterrows():
+        for (i, row), states in zip(df.iterrows(), statesList):
             position = Position(row['x'], row['y'])         
-            states = hwynet.project(position)
             
             # if point is not near any links, just skip this point
             if (len(states)==0):